@@ -1,11 +1,14 @@
 import os
+import importlib.util
+import logging
+import httpx
 import streamlit as st
 from dotenv import load_dotenv
 from openai import OpenAI
 
 from utils import chunk_transcript_segments
 from transcribe import get_transcription
-from summarize import process_chunks_for_content
+from summarize import HTTP_LIMITS, process_chunks_for_content
 from streamlit_mic_recorder import mic_recorder
 
 # --- Page Configuration ---
@@ -15,10 +18,35 @@ st.set_page_config(
     layout="wide",
 )
 
+# --- Logging ---
+# Diagnostics from the generation pipeline (e.g. prompt cache hits) are logged at
+# INFO. Only that logger is raised to INFO so httpx's per-request logs stay quiet.
+logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s")
+logging.getLogger("summarize").setLevel(logging.INFO)
+
 # --- Load Environment Variables and API Key ---
 load_dotenv()
 API_KEY_ENV = os.getenv("OPENAI_API_KEY")
 
+# Local transcription is optional; only offer it when faster-whisper is installed.
+LOCAL_WHISPER_AVAILABLE = importlib.util.find_spec("faster_whisper") is not None
+
+# --- OpenAI Client ---
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key: str) -> OpenAI:
+    """
+    Creates one OpenAI client per API key and reuses it across reruns, so its
+    HTTP/2 keep-alive connection is not re-established for every generation.
+    """
+    http_client = httpx.Client(
+        http2=True,
+        limits=HTTP_LIMITS,
+        # Transcribing a long lecture can take minutes before the first byte arrives
+        timeout=httpx.Timeout(600.0, connect=10.0),
+    )
+    return OpenAI(api_key=api_key, http_client=http_client)
+
 # --- UI Functions ---
 
 def display_sidebar():
@@ -36,7 +64,23 @@ def display_sidebar():
 
         st.info("💡 **Tip**: Don't have an API key? Get one from [OpenAI](https://platform.openai.com/account/api-keys).")
         
-        provider = "openai_api" # Hardcode for simplicity
+        provider = "openai_api"
+        skip_silence = False
+
+        # Transcription Options
+        if LOCAL_WHISPER_AVAILABLE:
+            st.header("🎧 Transcription")
+            provider_label = st.radio(
+                "Transcription provider:",
+                ["OpenAI API", "Local Whisper"],
+                help="Local Whisper runs on this machine instead of sending the audio to OpenAI."
+            )
+            if provider_label == "Local Whisper":
+                provider = "local_whisper"
+                skip_silence = st.toggle(
+                    "Aggressive silence skipping",
+                    help="Skips silent passages for faster transcription of lectures with pauses. May drop very quiet speech."
+                )
 
         # Content Generation Options
         st.header("📝 Output Options")
@@ -46,7 +90,7 @@ def display_sidebar():
             default=["Notes", "Flashcards"]
         )
         
-        return api_key, provider, [opt.lower() for opt in content_options]
+        return api_key, provider, skip_silence, [opt.lower() for opt in content_options]
 
 def display_audio_input():
     """Displays audio input options: file upload and in-browser recording."""
@@ -146,14 +190,14 @@ def main():
     st.title("🎙️ Lecture Voice-to-Notes Generator")
     st.markdown("Transform your lecture audio into organized study notes, flashcards, and quizzes effortlessly.")
 
-    api_key, provider, content_options = display_sidebar()
+    api_key, provider, skip_silence, content_options = display_sidebar()
 
     if not api_key:
         st.warning("Please enter your OpenAI API key in the sidebar to proceed.")
         st.stop()
     
     try:
-        client = OpenAI(api_key=api_key)
+        client = get_openai_client(api_key)
     except Exception as e:
         st.error(f"Failed to initialize OpenAI client: {e}")
         st.stop()
@@ -168,7 +212,7 @@ def main():
         with st.status("Processing your lecture... This may take a few minutes.", expanded=True) as status:
             # 1. Transcription
             st.write("Transcribing audio...")
-            transcript_data = get_transcription(provider, client, audio_file)
+            transcript_data = get_transcription(provider, client, audio_file, skip_silence)
             
             if not transcript_data or "segments" not in transcript_data:
                 status.update(label="Transcription failed. Please try a different audio file or check the API key.", state="error")
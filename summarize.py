@@ -1,20 +1,53 @@
-import json
-from openai import OpenAI
-from typing import List, Dict, Any, Literal, Generator
+import asyncio
+import functools
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import httpx
+import orjson
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError, RateLimitError
+from typing import List, Dict, Any, Generator, Optional, Tuple
 import streamlit as st
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
 
-from utils import DEFAULT_MODEL, format_timestamp
+from utils import DEFAULT_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on simultaneous connections used when fanning out chunk requests.
+# With HTTP/2 the requests are multiplexed, so usually only one is opened.
+MAX_CONNECTIONS = 32
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=MAX_CONNECTIONS, max_connections=MAX_CONNECTIONS)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=10.0)
+
+# Number of chunk requests in flight at once, kept below the per-minute rate limit.
+MAX_CONCURRENT_REQUESTS = 8
+
+# Streamed output is re-rendered after this many new characters, and only the
+# tail of the buffer is shown, to keep UI updates cheap.
+STREAM_RENDER_INTERVAL = 200
+STREAM_PREVIEW_CHARS = 600
+
+# Maximum number of (chunk, content type) results kept in the response cache.
+CACHE_MAX_ENTRIES = 256
 
 # --- PROMPT DEFINITIONS ---
+# Prompt text is kept in module-level constants. The per-type sections are used
+# verbatim; only the system and chunk templates (`_TMPL`) are filled in with
+# str.format.
+#
+# OpenAI caches identical prompt prefixes of 1024+ tokens and bills cached input
+# at a discount. Everything that is the same for every chunk (instructions and
+# examples) therefore lives in the system message, and the user message carries
+# only the chunk's time range and transcript text, so caching applies on its own
+# once the fixed instructions grow past the threshold.
 
-def get_notes_prompt(chunk_text: str, start_time: float, end_time: float) -> str:
-    """Generates the prompt for creating hierarchical notes from a text chunk."""
-    return f"""
-    You are an expert academic assistant. Your task is to create detailed, structured study notes 
-    from a transcript chunk of a lecture. The provided chunk is from {format_timestamp(start_time)} to {format_timestamp(end_time)}.
+CONTENT_TYPES = ('notes', 'flashcards', 'quiz')
 
-    Analyze the following text and generate notes in valid JSON format with the following structure:
-    {{
+_NOTES_SECTION = """
+    "notes": Detailed, structured study notes for the chunk. Use this structure:
+    {
       "title": "A concise, descriptive title for this section (5-10 words)",
       "summary": "A 2-4 sentence summary of the main points in this chunk.",
       "key_points": [
@@ -22,170 +55,419 @@ def get_notes_prompt(chunk_text: str, start_time: float, end_time: float) -> str
         "Each point should be a complete sentence.",
         "Extract at least 3-5 key points."
       ]
-    }}
-
-    Transcript Chunk:
-    ---
-    {chunk_text}
-    ---
-
-    Ensure the output is only the JSON object, without any surrounding text or markdown.
+    }
     """
 
-def get_flashcards_prompt(chunk_text: str) -> str:
-    """Generates the prompt for creating flashcards."""
-    return f"""
-    You are a study aid tool. Based on the following lecture transcript chunk, generate exactly 10 flashcards
-    to help a student learn the material.
-
+_FLASHCARDS_SECTION = """
+    "flashcards": Exactly 10 flashcards to help a student learn the material.
     For each flashcard, provide a clear, concise question and a direct answer.
-    Return the output as a valid JSON object containing a single key "flashcards" which is a list of objects,
-    where each object has a "question" and "answer" key.
+    Example format:
+    [
+      {
+        "question": "What is the capital of France?",
+        "answer": "Paris."
+      },
+      {
+        "question": "What is the formula for water?",
+        "answer": "H2O."
+      }
+    ]
+    """
 
+_QUIZ_SECTION = """
+    "quiz": A multiple-choice quiz with exactly 5 questions. For each question, provide:
+    - The question text.
+    - A list of 4 options (one correct, three plausible distractors).
+    - The correct answer, copied exactly from the options.
     Example format:
-    {{
-      "flashcards": [
-        {{
-          "question": "What is the capital of France?",
-          "answer": "Paris."
-        }},
-        {{
-          "question": "What is the formula for water?",
-          "answer": "H2O."
-        }}
-      ]
-    }}
+    [
+      {
+        "question": "Which planet is known as the Red Planet?",
+        "options": ["Earth", "Mars", "Jupiter", "Venus"],
+        "correct_answer": "Mars"
+      }
+    ]
+    """
+
+_SYSTEM_TMPL = """
+    You are an expert academic assistant helping a student study a lecture.
+    You will be given a chunk of a lecture transcript. Analyze it and return a
+    single valid JSON object with the keys {keys}, described below.
+    {sections}
+    Ensure the output is only the JSON object, without any surrounding text or markdown.
+    """
+
+_CHUNK_TMPL = """
+    This chunk covers {timestamp} of the lecture.
 
     Transcript Chunk:
     ---
     {chunk_text}
     ---
+    """
+
+_SECTION_MAP = {
+    'notes': _NOTES_SECTION,
+    'flashcards': _FLASHCARDS_SECTION,
+    'quiz': _QUIZ_SECTION,
+}
 
-    Generate exactly 10 flashcards. Ensure the output is only the JSON object.
+@functools.lru_cache(maxsize=None)
+def get_system_prompt(wanted: Tuple[str, ...]) -> str:
     """
+    Generates the system message asking for every wanted content type at once.
+    It does not depend on the chunk, so it is identical for every request.
+    """
+    sections = "".join(_SECTION_MAP[ctype] for ctype in wanted)
+    keys = ", ".join(f'"{ctype}"' for ctype in wanted)
 
-def get_quiz_prompt(chunk_text: str) -> str:
-    """Generates the prompt for creating a multiple-choice quiz."""
-    return f"""
-    You are an expert quiz creator. From the following lecture transcript chunk, create a multiple-choice quiz
-    with exactly 5 questions.
+    return _SYSTEM_TMPL.format(keys=keys, sections=sections)
 
-    For each question, provide:
-    - The question text.
-    - A list of 4 options (one correct, three plausible distractors).
-    - The correct answer.
+def get_chunk_prompt(chunk_text: str, timestamp_str: str) -> str:
+    """Generates the user message carrying a single transcript chunk and its preformatted time range."""
+    return _CHUNK_TMPL.format(timestamp=timestamp_str, chunk_text=chunk_text)
 
-    Return the output as a valid JSON object containing a single key "quiz" which is a list of objects.
-    Each object must have "question", "options", and "correct_answer" keys.
 
-    Example format:
-    {{
-      "quiz": [
-        {{
-          "question": "Which planet is known as the Red Planet?",
-          "options": ["Earth", "Mars", "Jupiter", "Venus"],
-          "correct_answer": "Mars"
-        }}
-      ]
-    }}
-    
-    Transcript Chunk:
-    ---
-    {chunk_text}
-    ---
+# --- RESPONSE SCHEMAS ---
+
+NOTES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "summary": {"type": "string"},
+        "key_points": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["title", "summary", "key_points"],
+    "additionalProperties": False,
+}
 
-    Generate exactly 5 questions. Ensure the output is only the JSON object.
+FLASHCARDS_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "answer": {"type": "string"},
+        },
+        "required": ["question", "answer"],
+        "additionalProperties": False,
+    },
+}
+
+QUIZ_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string"},
+            "options": {"type": "array", "items": {"type": "string"}},
+            "correct_answer": {"type": "string"},
+        },
+        "required": ["question", "options", "correct_answer"],
+        "additionalProperties": False,
+    },
+}
+
+SCHEMA_MAP = {
+    'notes': NOTES_SCHEMA,
+    'flashcards': FLASHCARDS_SCHEMA,
+    'quiz': QUIZ_SCHEMA,
+}
+
+def get_response_format(wanted: Tuple[str, ...]) -> Dict[str, Any]:
     """
+    Builds a strict JSON schema response format containing only the wanted
+    content types, so unselected outputs are never generated (or billed).
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "lecture_study_materials",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {ctype: SCHEMA_MAP[ctype] for ctype in wanted},
+                "required": list(wanted),
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+# --- RESPONSE CACHE ---
+# Re-running the same lecture (e.g. after toggling output options) should not
+# pay for API calls again. Results are cached per chunk and content type, so a
+# new selection only requests the content types that have not been seen yet.
+
+_cache_lock = threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def _get_response_cache() -> "OrderedDict[str, Any]":
+    """Returns the process-wide response cache, shared across reruns and sessions."""
+    return OrderedDict()
+
+def _cache_key(chunk: Dict[str, Any], content_type: str, model: str) -> str:
+    """Builds a stable cache key for one content type generated from one chunk."""
+    digest = hashlib.sha1(chunk['text'].encode("utf-8")).hexdigest()
+    return f"{model}:{content_type}:{chunk['start_time']}:{chunk['end_time']}:{digest}"
+
+def _cache_get(key: str) -> Optional[Any]:
+    """Returns a cached result, or None if the key is not cached."""
+    cache = _get_response_cache()
+    with _cache_lock:
+        if key not in cache:
+            return None
+        cache.move_to_end(key)
+        return cache[key]
+
+def _cache_put(key: str, value: Any) -> None:
+    """Stores a result, evicting the least recently used entries past the limit."""
+    cache = _get_response_cache()
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
 
 
 # --- CONTENT GENERATION ---
 
-def generate_content_for_chunk(
-    client: OpenAI,
+def _build_request(chunk: Dict[str, Any], content_types: List[str]) -> Dict[str, Any]:
+    """Builds the chat completion arguments for one chunk and its wanted content types."""
+    invalid = [ctype for ctype in content_types if ctype not in CONTENT_TYPES]
+    if invalid:
+        raise ValueError(f"Invalid content type: {', '.join(invalid)}")
+
+    # Keep a fixed order so identical selections always produce identical prompts
+    wanted = tuple(ctype for ctype in CONTENT_TYPES if ctype in content_types)
+
+    return {
+        "messages": [
+            {"role": "system", "content": get_system_prompt(wanted)},
+            {"role": "user", "content": get_chunk_prompt(chunk['text'], chunk['timestamp_str'])}
+        ],
+        "response_format": get_response_format(wanted),
+    }
+
+
+def _is_transient_error(error: BaseException) -> bool:
+    """
+    Returns True for errors worth retrying: the ones the SDK retries by default
+    (connection errors and timeouts, 408, 409, 429 and 5xx responses), except a
+    429 for an exhausted quota, which waiting will not fix.
+    """
+    if isinstance(error, RateLimitError):
+        return error.code != "insufficient_quota"
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+# Transient errors are retried with jittered exponential backoff instead of
+# silently dropping the chunk. This replaces the SDK's own retries, which are
+# disabled on these calls so the two don't multiply.
+_retry_transient_errors = retry(
+    reraise=True,
+    retry=retry_if_exception(_is_transient_error),
+    wait=wait_random_exponential(min=1, max=30),
+    stop=stop_after_attempt(6),
+)
+
+@_retry_transient_errors
+async def _astream_completion(
+    async_client: AsyncOpenAI,
+    model: str,
+    request: Dict[str, Any],
+    placeholder: Optional[Any],
+    usage_totals: Optional[Dict[str, int]]
+) -> str:
+    """Streams one chat completion request, rendering progress, and returns the full content."""
+    stream = await async_client.with_options(max_retries=0).chat.completions.create(
+        model=model,
+        temperature=0.3, # Lower temperature for more deterministic, factual output
+        stream=True,
+        stream_options={"include_usage": True},
+        **request,
+    )
+    buffer = ""
+    last_rendered = 0
+    async for event in stream:
+        # The final event has no choices and reports token usage for the request
+        if event.usage is not None and usage_totals is not None:
+            details = event.usage.prompt_tokens_details
+            usage_totals["prompt_tokens"] += event.usage.prompt_tokens
+            usage_totals["cached_tokens"] += (details.cached_tokens or 0) if details else 0
+        if not event.choices:
+            continue
+        buffer += event.choices[0].delta.content or ""
+        if placeholder is not None and len(buffer) - last_rendered >= STREAM_RENDER_INTERVAL:
+            placeholder.code(buffer[-STREAM_PREVIEW_CHARS:], language="json")
+            last_rendered = len(buffer)
+    return buffer
+
+
+async def agenerate_content_for_chunk(
+    async_client: AsyncOpenAI,
     chunk: Dict[str, Any],
-    content_type: Literal['notes', 'flashcards', 'quiz'],
-    model: str = DEFAULT_MODEL
+    content_types: List[str],
+    model: str = DEFAULT_MODEL,
+    placeholder: Optional[Any] = None,
+    usage_totals: Optional[Dict[str, int]] = None
 ) -> Dict[str, Any]:
     """
-    Calls the OpenAI API to generate a specific type of content for a single text chunk.
+    Calls the OpenAI API once to generate all requested content types for a single text chunk.
+    The response is streamed so partial output can be shown while it is generated.
 
     Args:
-        client (OpenAI): The OpenAI API client.
+        async_client (AsyncOpenAI): The async OpenAI API client.
         chunk (Dict[str, Any]): A dictionary containing the chunk text and timestamps.
-        content_type (str): The type of content to generate ('notes', 'flashcards', 'quiz').
+        content_types (List[str]): The types of content to generate ('notes', 'flashcards', 'quiz').
         model (str): The GPT model to use for generation.
+        placeholder (Optional[Any]): A Streamlit placeholder to render streamed output into.
+        usage_totals (Optional[Dict[str, int]]): Running "prompt_tokens" and "cached_tokens"
+            totals to add this request's usage to.
 
     Returns:
-        Dict[str, Any]: The parsed JSON response from the API.
+        Dict[str, Any]: The parsed JSON response from the API, keyed by content type.
     """
-    prompt_map = {
-        'notes': get_notes_prompt(chunk['text'], chunk['start_time'], chunk['end_time']),
-        'flashcards': get_flashcards_prompt(chunk['text']),
-        'quiz': get_quiz_prompt(chunk['text']),
-    }
-    
-    prompt = prompt_map.get(content_type)
-    if not prompt:
-        raise ValueError(f"Invalid content type: {content_type}")
+    request = _build_request(chunk, content_types)
 
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are a helpful academic assistant that outputs structured JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.3, # Lower temperature for more deterministic, factual output
-        )
-        content = response.choices[0].message.content
-        return json.loads(content)
+        buffer = await _astream_completion(async_client, model, request, placeholder, usage_totals)
+        # The JSON is only complete once the stream has closed
+        return orjson.loads(buffer)
     except Exception as e:
-        st.error(f"Error generating {content_type} for a chunk: {e}")
+        st.error(f"Error generating content for a chunk: {e}")
         return {}
 
 
+async def _agenerate_all(
+    api_key: str,
+    requests: List[Tuple[Dict[str, Any], List[str]]],
+    progress_bar: Any,
+    placeholders: List[Any],
+    usage_totals: Dict[str, int],
+    model: str = DEFAULT_MODEL
+) -> List[Any]:
+    """
+    Sends one request per (chunk, wanted content types) pair concurrently over a
+    shared connection pool. Results are returned in the same order as the pairs.
+    """
+    # All requests share one HTTP/2 connection instead of a TLS handshake each
+    async_client = AsyncOpenAI(
+        api_key=api_key,
+        http_client=httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+    )
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    total = len(requests)
+    completed = 0
+
+    async def run(chunk: Dict[str, Any], wanted: List[str], placeholder: Any) -> Dict[str, Any]:
+        nonlocal completed
+        try:
+            async with semaphore:
+                return await agenerate_content_for_chunk(
+                    async_client, chunk, wanted, model=model,
+                    placeholder=placeholder, usage_totals=usage_totals
+                )
+        finally:
+            placeholder.empty()
+            # Coroutines all run on the script thread, so updating the UI here is safe
+            completed += 1
+            progress_bar.progress(completed / total, text=f"Processing chunk {completed}/{total}...")
+
+    tasks = [
+        run(chunk, wanted, placeholder)
+        for (chunk, wanted), placeholder in zip(requests, placeholders)
+    ]
+    try:
+        return await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        await async_client.close()
+
+
 def process_chunks_for_content(
     client: OpenAI,
     chunks: Generator[Dict[str, Any], None, None],
-    content_types: List[str]
+    content_types: List[str],
+    model: str = DEFAULT_MODEL
 ) -> Dict[str, List[Any]]:
     """
     Iterates through text chunks and generates all requested content types.
+    Content already generated for a chunk in an earlier run is served from the cache.
 
     Args:
         client (OpenAI): The OpenAI API client.
         chunks (Generator): A generator yielding text chunks.
         content_types (List[str]): A list of content types to generate (e.g., ['notes']).
+        model (str): The model to generate with; cached content is kept per model.
 
     Returns:
         Dict[str, List[Any]]: A dictionary where keys are content types and values are
                                lists of generated content items.
     """
     generated_content = {ctype: [] for ctype in content_types}
-    
-    # Convert generator to list to show progress
     chunk_list = list(chunks)
-    progress_bar = st.progress(0, text="Generating content from lecture chunks...")
-
-    for i, chunk in enumerate(chunk_list):
-        for content_type in content_types:
-            # Generate one type of content per API call to keep prompts focused
-            result = generate_content_for_chunk(client, chunk, content_type)
-            
-            if result:
-                # For notes, add the timestamp directly
-                if content_type == 'notes':
-                    result['timestamp'] = f"{format_timestamp(chunk['start_time'])} - {format_timestamp(chunk['end_time'])}"
-                    generated_content['notes'].append(result)
-                # For flashcards and quizzes, the result is a dict with a key like "flashcards"
-                # We extend the main list with the items from the chunk
-                elif content_type in ['flashcards', 'quiz']:
-                    if content_type in result and isinstance(result[content_type], list):
-                        generated_content[content_type].extend(result[content_type])
-        
-        # Update progress bar
-        progress_bar.progress((i + 1) / len(chunk_list), text=f"Processing chunk {i+1}/{len(chunk_list)}...")
-
-    progress_bar.empty() # Clear the progress bar
+
+    # Look up every (chunk, content type) pair and only request what is missing
+    chunk_results = []
+    requests = []
+    for chunk in chunk_list:
+        hits = {}
+        for ctype in content_types:
+            value = _cache_get(_cache_key(chunk, ctype, model))
+            if value is not None:
+                hits[ctype] = value
+        chunk_results.append(hits)
+        missing = [ctype for ctype in content_types if ctype not in hits]
+        if missing:
+            requests.append((chunk, missing))
+
+    if requests:
+        progress_bar = st.progress(0, text="Generating content from lecture chunks...")
+        # One live preview per request, cleared as soon as that chunk finishes
+        placeholders = [st.empty() for _ in requests]
+
+        # All requests are independent and I/O-bound, so they are awaited together
+        # instead of paying a full round-trip for each one in turn.
+        usage_totals = {"prompt_tokens": 0, "cached_tokens": 0}
+        results = asyncio.run(
+            _agenerate_all(client.api_key, requests, progress_bar, placeholders, usage_totals, model)
+        )
+        progress_bar.empty() # Clear the progress bar
+        logger.info(
+            "Prompt cache: %d of %d input tokens were served from cache.",
+            usage_totals["cached_tokens"],
+            usage_totals["prompt_tokens"],
+        )
+
+        results_iter = iter(results)
+        for chunk, hits in zip(chunk_list, chunk_results):
+            if all(ctype in hits for ctype in content_types):
+                continue
+            result = next(results_iter)
+            if isinstance(result, Exception):
+                st.error(f"Error generating content for a chunk: {result}")
+                continue
+            for ctype in content_types:
+                if ctype not in hits and result.get(ctype):
+                    hits[ctype] = result[ctype]
+                    _cache_put(_cache_key(chunk, ctype, model), result[ctype])
+
+    # Demultiplex each chunk's results, in chunk order so the output is deterministic
+    for chunk, result in zip(chunk_list, chunk_results):
+        # For notes, the result is a single object; add the timestamp to a copy
+        # so the cached entry is left untouched
+        note = result.get('notes')
+        if 'notes' in content_types and isinstance(note, dict):
+            note = dict(note)
+            note['timestamp'] = chunk['timestamp_str']
+            generated_content['notes'].append(note)
+
+        # For flashcards and quizzes, the result is a list of items
+        # We extend the main list with the items from the chunk
+        for content_type in ['flashcards', 'quiz']:
+            items = result.get(content_type)
+            if content_type in content_types and isinstance(items, list):
+                generated_content[content_type].extend(items)
+
     return generated_content
\ No newline at end of file
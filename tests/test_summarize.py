@@ -0,0 +1,168 @@
+import asyncio
+import json
+from collections import OrderedDict
+from types import SimpleNamespace
+from unittest.mock import patch
+import httpx
+import pytest
+from openai import APIConnectionError, InternalServerError, RateLimitError
+from tenacity import wait_none
+from .. import summarize  # Use relative import for local testing
+
+# --- Fake OpenAI client ---
+
+CANNED_CONTENT = {
+    'notes': {"title": "Title", "summary": "Summary.", "key_points": ["Point one."]},
+    'flashcards': [{"question": "Q?", "answer": "A."}],
+    'quiz': [{"question": "Q?", "options": ["A", "B", "C", "D"], "correct_answer": "A"}],
+}
+
+class FakeStream:
+    """Replays a response as streamed deltas followed by a usage-only event."""
+
+    def __init__(self, content: str):
+        self.parts = [content[i:i + 20] for i in range(0, len(content), 20)]
+
+    async def __aiter__(self):
+        for part in self.parts:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))], usage=None)
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=10, prompt_tokens_details=None))
+
+class FakeAsyncOpenAI:
+    """Answers each request with canned content for the content types in its schema."""
+
+    def __init__(self, calls: list, errors: list = None):
+        self.calls = calls
+        self.errors = list(errors or [])
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.errors:
+            raise self.errors.pop(0)
+        wanted = kwargs['response_format']['json_schema']['schema']['properties']
+        return FakeStream(json.dumps({ctype: CANNED_CONTENT[ctype] for ctype in wanted}))
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def close(self):
+        pass
+
+def requested_types(call: dict) -> list:
+    """Returns the content types a recorded request asked for."""
+    return sorted(call['response_format']['json_schema']['schema']['properties'])
+
+MOCK_CHUNKS = [
+    {"text": "First chunk.", "start_time": 0.0, "end_time": 60.0, "timestamp_str": "00:00 - 01:00"},
+    {"text": "Second chunk.", "start_time": 60.0, "end_time": 120.0, "timestamp_str": "01:00 - 02:00"},
+]
+
+# --- Test process_chunks_for_content ---
+
+def test_process_chunks_demultiplexes_combined_response():
+    """Test that one combined response per chunk is split into each content type."""
+    calls = []
+    with patch.object(summarize, 'AsyncOpenAI', lambda **kwargs: FakeAsyncOpenAI(calls)), \
+         patch.object(summarize, '_get_response_cache', return_value=OrderedDict()):
+        content = summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes', 'flashcards', 'quiz']
+        )
+
+    assert len(calls) == len(MOCK_CHUNKS)
+    assert [note['timestamp'] for note in content['notes']] == ["00:00 - 01:00", "01:00 - 02:00"]
+    assert len(content['flashcards']) == 2
+    assert len(content['quiz']) == 2
+
+def test_process_chunks_only_requests_missing_types():
+    """Test that a re-run with one more content type only asks the API for that type."""
+    calls = []
+    cache = OrderedDict()
+    with patch.object(summarize, 'AsyncOpenAI', lambda **kwargs: FakeAsyncOpenAI(calls)), \
+         patch.object(summarize, '_get_response_cache', return_value=cache):
+        summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes', 'flashcards']
+        )
+        assert [requested_types(call) for call in calls] == [['flashcards', 'notes']] * 2
+
+        calls.clear()
+        content = summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes', 'flashcards', 'quiz']
+        )
+
+    assert [requested_types(call) for call in calls] == [['quiz']] * 2
+    assert len(content['notes']) == 2
+    assert len(content['flashcards']) == 2
+    assert len(content['quiz']) == 2
+
+    # The timestamp is added to a copy, never to the cached note
+    cached_notes = [value for key, value in cache.items() if ':notes:' in key]
+    assert len(cached_notes) == 2
+    assert all('timestamp' not in note for note in cached_notes)
+
+def test_process_chunks_fully_cached_makes_no_requests():
+    """Test that a re-run with the same selection is served entirely from the cache."""
+    calls = []
+    with patch.object(summarize, 'AsyncOpenAI', lambda **kwargs: FakeAsyncOpenAI(calls)), \
+         patch.object(summarize, '_get_response_cache', return_value=OrderedDict()):
+        first = summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes']
+        )
+        calls.clear()
+        second = summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes']
+        )
+
+    assert calls == []
+    assert second == first
+
+def test_process_chunks_caches_per_model():
+    """Test that content cached for one model is not served for another."""
+    calls = []
+    with patch.object(summarize, 'AsyncOpenAI', lambda **kwargs: FakeAsyncOpenAI(calls)), \
+         patch.object(summarize, '_get_response_cache', return_value=OrderedDict()):
+        summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes']
+        )
+        calls.clear()
+        summarize.process_chunks_for_content(
+            SimpleNamespace(api_key="test"), iter(MOCK_CHUNKS), ['notes'], model="gpt-4o"
+        )
+
+    assert len(calls) == len(MOCK_CHUNKS)
+    assert all(call['model'] == "gpt-4o" for call in calls)
+
+# --- Test retries ---
+
+def make_status_error(error_class, status_code: int, code: str = None):
+    """Builds an OpenAI status error as the SDK would raise it."""
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    body = {"code": code} if code else None
+    return error_class("error", response=httpx.Response(status_code, request=request), body=body)
+
+@pytest.fixture
+def no_retry_wait():
+    """Removes the backoff delay between retries."""
+    with patch.object(summarize._astream_completion.retry, 'wait', wait_none()):
+        yield
+
+@pytest.mark.parametrize("error", [
+    make_status_error(RateLimitError, 429),
+    make_status_error(InternalServerError, 500),
+    APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions")),
+])
+def test_generation_retries_transient_errors(no_retry_wait, error):
+    """Test that a transient error is retried and the chunk still succeeds."""
+    calls = []
+    client = FakeAsyncOpenAI(calls, errors=[error])
+    result = asyncio.run(summarize.agenerate_content_for_chunk(client, MOCK_CHUNKS[0], ['notes']))
+    assert len(calls) == 2
+    assert result == {'notes': CANNED_CONTENT['notes']}
+
+def test_generation_does_not_retry_insufficient_quota(no_retry_wait):
+    """Test that a 429 for an exhausted quota fails immediately."""
+    calls = []
+    client = FakeAsyncOpenAI(calls, errors=[make_status_error(RateLimitError, 429, code="insufficient_quota")])
+    result = asyncio.run(summarize.agenerate_content_for_chunk(client, MOCK_CHUNKS[0], ['notes']))
+    assert len(calls) == 1
+    assert result == {}
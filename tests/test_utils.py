@@ -36,7 +36,7 @@ MOCK_SEGMENTS = [
     {'text': ' The final segment is quite long as well, pushing the token limit.', 'start': 10.5, 'end': 15.0},
 ]
 
-@patch('utils.estimate_token_count')
+@patch('utils.estimate_token_counts')
 def test_chunking_with_token_limit(mock_estimate_tokens):
     """
     Test that segments are chunked correctly based on a mocked token count.
@@ -49,14 +49,15 @@ def test_chunking_with_token_limit(mock_estimate_tokens):
         ' Fourth segment here.': 5,
         ' The final segment is quite long as well, pushing the token limit.': 25
     }
-    # Mock the estimator to return our predefined counts
-    mock_estimate_tokens.side_effect = lambda text: sum(
-        token_counts[s] for s in token_counts if s in text
-    )
+    # Mock the batch estimator to return our predefined counts
+    mock_estimate_tokens.side_effect = lambda texts: [token_counts[t] for t in texts]
 
     # Set a limit that forces a split, expecting 2 chunks.
-    max_tokens = 40 
-    chunks = list(utils.chunk_transcript_segments(MOCK_SEGMENTS, max_tokens_per_chunk=max_tokens))
+    # Each joining space between segments is counted as one token.
+    max_tokens = 41
+    chunks = list(utils.chunk_transcript_segments(
+        MOCK_SEGMENTS, max_tokens_per_chunk=max_tokens, min_tokens_per_chunk=0
+    ))
     
     assert len(chunks) == 2
     assert "second sentence" in chunks[0]['text']
@@ -64,13 +65,44 @@ def test_chunking_with_token_limit(mock_estimate_tokens):
     assert chunks[0]['end_time'] == 7.0
     assert "final segment" in chunks[1]['text']
     assert chunks[1]['start_time'] == 7.5
+    assert chunks[1]['timestamp_str'] == "00:07 - 00:15"
+
+@patch('utils.estimate_token_counts')
+def test_chunking_counts_all_segments_in_one_batch(mock_estimate_tokens):
+    """Test that all segments are tokenized in a single batch call."""
+    mock_estimate_tokens.side_effect = lambda texts: [5] * len(texts)
+    list(utils.chunk_transcript_segments(MOCK_SEGMENTS, max_tokens_per_chunk=1000))
+    mock_estimate_tokens.assert_called_once_with([s['text'] for s in MOCK_SEGMENTS])
+
+@patch('utils.estimate_token_counts', side_effect=lambda texts: [10] * len(texts))
+def test_chunking_merges_short_tail(mock_estimate_tokens):
+    """Test that a final chunk below the minimum is merged into the previous one."""
+    # 10 + 1 + 10 + 1 + 10 = 32 tokens fill the first chunk; the last two
+    # segments (21 tokens) fall below the minimum and are merged back into it.
+    chunks = list(utils.chunk_transcript_segments(
+        MOCK_SEGMENTS, max_tokens_per_chunk=32, min_tokens_per_chunk=25
+    ))
+    assert len(chunks) == 1
+    assert chunks[0]['start_time'] == 0.0
+    assert chunks[0]['end_time'] == 15.0
+    assert "final segment" in chunks[0]['text']
+
+@patch('utils.estimate_token_counts', side_effect=lambda texts: [10] * len(texts))
+def test_chunking_keeps_long_tail(mock_estimate_tokens):
+    """Test that a final chunk at or above the minimum is yielded on its own."""
+    chunks = list(utils.chunk_transcript_segments(
+        MOCK_SEGMENTS, max_tokens_per_chunk=32, min_tokens_per_chunk=21
+    ))
+    assert len(chunks) == 2
+    assert chunks[0]['end_time'] == 8.5
+    assert chunks[1]['start_time'] == 9.0
 
 def test_chunking_empty_segments():
     """Test that the chunker handles empty input gracefully."""
     chunks = list(utils.chunk_transcript_segments([]))
     assert len(chunks) == 0
 
-@patch('utils.estimate_token_count', return_value=5)
+@patch('utils.estimate_token_counts', side_effect=lambda texts: [5] * len(texts))
 def test_chunking_no_split_needed(mock_estimate_tokens):
     """Test that if total tokens are under the limit, only one chunk is created."""
     chunks = list(utils.chunk_transcript_segments(MOCK_SEGMENTS, max_tokens_per_chunk=1000))
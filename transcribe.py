@@ -1,4 +1,6 @@
 import os
+import mimetypes
+import tempfile
 from typing import Dict, Any, Literal
 from openai import OpenAI
 import streamlit as st
@@ -7,29 +9,33 @@ import streamlit as st
 
 def transcribe_with_openai_api(
     client: OpenAI, 
-    audio_file_path: str,
-    temp_file_path: str # Used to write bytes from UploadedFile
+    file_bytes: bytes,
+    filename: str
 ) -> Dict[str, Any]:
     """
     Transcribes audio using the OpenAI Whisper API with word-level timestamps.
 
+    The audio bytes are uploaded directly from memory, without a round-trip
+    through a temporary file.
+
     Args:
         client (OpenAI): The OpenAI API client.
-        audio_file_path (str): The path to the audio file.
-        temp_file_path (str): Path to the temporary file for API upload.
+        file_bytes (bytes): The raw audio file contents.
+        filename (str): The original file name, used by the API to detect the format.
 
     Returns:
         Dict[str, Any]: The full transcription response object from OpenAI,
                         including text and segments with timestamps.
     """
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
     try:
-        with open(temp_file_path, "rb") as audio_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="verbose_json",
-                timestamp_granularities=["segment"]
-            )
+        transcript = client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(filename, file_bytes, mimetype),
+            response_format="verbose_json",
+            timestamp_granularities=["segment"]
+        )
         # The API returns a Pydantic model, convert it to a dict for consistency
         return transcript.model_dump()
     except Exception as e:
@@ -37,76 +43,112 @@ def transcribe_with_openai_api(
         return {}
 
 
-def transcribe_with_local_whisper(audio_file_path: str) -> Dict[str, Any]:
+# Using a smaller model for faster local processing.
+# Options: "tiny", "base", "small", "medium", "large-v3"
+LOCAL_WHISPER_MODEL_SIZE = "base"
+
+@st.cache_resource(show_spinner="Loading local Whisper model...")
+def _get_whisper_model(size: str = LOCAL_WHISPER_MODEL_SIZE) -> Any:
+    """
+    Loads a local Whisper model once per size. Streamlit re-runs the whole script
+    on every interaction, so the weights would otherwise be reloaded from disk
+    for each generation. The model is shared across reruns and sessions.
+    """
+    from faster_whisper import WhisperModel
+
+    # INT8 weights keep CPU inference fast with no measurable loss in accuracy.
+    return WhisperModel(size, device="auto", compute_type="int8")
+
+def transcribe_with_local_whisper(audio_file_path: str, skip_silence: bool = False) -> Dict[str, Any]:
     """
-    Transcribes audio using the local 'openai-whisper' library.
-    NOTE: This requires 'openai-whisper' and 'torch' to be installed,
-    and 'ffmpeg' to be available on the system PATH.
+    Transcribes audio locally using the 'faster-whisper' (CTranslate2) library.
+    NOTE: This requires 'faster-whisper' to be installed.
 
     Args:
         audio_file_path (str): The path to the audio file.
+        skip_silence (bool): Trade some accuracy for speed by skipping silent
+            passages with voice activity detection.
 
     Returns:
         Dict[str, Any]: A dictionary matching the OpenAI API's verbose_json format.
     """
     try:
-        import whisper
+        from faster_whisper import decode_audio
     except ImportError:
         st.error(
             "Local Whisper provider selected, but the required packages are not installed. "
-            "Please run: pip install openai-whisper torch"
+            "Please run: pip install faster-whisper"
         )
         return {}
 
     try:
-        # Using a smaller model for faster local processing.
-        # Options: "tiny", "base", "small", "medium", "large"
-        model = whisper.load_model("base") 
-        result = model.transcribe(audio_file_path)
-        return result
+        model = _get_whisper_model()
+        # Decode to 16kHz mono float32 once; any further pass over the audio
+        # (e.g. language detection) can then reuse the buffer without re-decoding.
+        audio = decode_audio(audio_file_path)
+        if skip_silence:
+            # VAD drops silence before decoding, and not conditioning on the
+            # previous text stops a hallucination in one pause from cascading.
+            silence_options = {
+                "vad_filter": True,
+                "condition_on_previous_text": False,
+            }
+        else:
+            silence_options = {}
+        segments, _info = model.transcribe(audio, word_timestamps=False, **silence_options)
+        # Segments are generated lazily; materialize them in the verbose_json shape
+        segments = [{"text": s.text, "start": s.start, "end": s.end} for s in segments]
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "segments": segments,
+        }
     except Exception as e:
         st.error(f"Error during local Whisper transcription: {e}")
-        st.info("Please ensure you have `ffmpeg` installed on your system. It's a required dependency for local Whisper.")
+        st.info("Please ensure the audio file is in a supported format and not corrupted.")
         return {}
 
 def get_transcription(
     provider: Literal['openai_api', 'local_whisper'],
     client: OpenAI,
-    uploaded_file: Any
+    uploaded_file: Any,
+    skip_silence: bool = False
 ) -> Dict[str, Any]:
     """
     Main transcription handler that routes to the correct provider.
     
-    It saves the uploaded file temporarily to disk because both local whisper
-    and the OpenAI client work most reliably with file paths.
+    The OpenAI API receives the audio bytes directly. Local whisper reads
+    from a file path, so only that provider writes a temporary file.
 
     Args:
         provider (str): The chosen transcription provider.
         client (OpenAI): The OpenAI API client.
         uploaded_file (Any): The file-like object from Streamlit's uploader.
+        skip_silence (bool): Skip silent passages (local Whisper only).
 
     Returns:
         Dict[str, Any]: The transcription result.
     """
-    temp_dir = "temp_audio"
-    os.makedirs(temp_dir, exist_ok=True)
-    temp_file_path = os.path.join(temp_dir, uploaded_file.name)
+    if provider == 'openai_api':
+        # Both Streamlit's UploadedFile and a BytesIO recording expose getvalue()
+        return transcribe_with_openai_api(client, uploaded_file.getvalue(), uploaded_file.name)
+
+    if provider != 'local_whisper':
+        st.error(f"Unknown transcription provider: {provider}")
+        return {}
+
+    # Write the uploaded file bytes to a uniquely named temporary file, so
+    # concurrent sessions uploading the same file name never collide. The file
+    # is closed before transcribing because Windows cannot reopen it otherwise.
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    temp_file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    temp_file_path = temp_file.name
 
     try:
-        # Write the uploaded file bytes to a temporary file
-        with open(temp_file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        
-        if provider == 'openai_api':
-            result = transcribe_with_openai_api(client, uploaded_file.name, temp_file_path)
-        elif provider == 'local_whisper':
-            result = transcribe_with_local_whisper(temp_file_path)
-        else:
-            st.error(f"Unknown transcription provider: {provider}")
-            result = {}
+        with temp_file:
+            temp_file.write(uploaded_file.getbuffer())
+        result = transcribe_with_local_whisper(temp_file_path, skip_silence)
     finally:
         # Clean up the temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        os.unlink(temp_file_path)
     
     return result
\ No newline at end of file
@@ -1,12 +1,17 @@
+import functools
+import os
 import tiktoken
 from typing import List, Dict, Any, Generator
 
 # --- COST & TOKEN MANAGEMENT ---
 # Recommended model for a balance of cost, speed, and quality.
-# Other options: "gpt-4-turbo", "gpt-3.5-turbo"
+# Content generation uses strict JSON-schema structured outputs, so any other
+# model must support them. Other options: "gpt-4o"
+# ("gpt-4-turbo" and "gpt-3.5-turbo" reject the strict response format.)
 DEFAULT_MODEL = "gpt-4o-mini"
 TOKEN_LIMITS = {
     "gpt-4o-mini": 128000,
+    "gpt-4o": 128000,
     "gpt-4-turbo": 128000,
     "gpt-3.5-turbo": 16385,
 }
@@ -15,6 +20,15 @@ def get_token_limit(model: str = DEFAULT_MODEL) -> int:
     """Returns the token limit for a given model."""
     return TOKEN_LIMITS.get(model, 4096) # Default to 4096 if model not found
 
+@functools.lru_cache(maxsize=8)
+def _get_encoding(model: str = DEFAULT_MODEL) -> tiktoken.Encoding:
+    """Returns the tiktoken encoding for a model, cached so it is only looked up once."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        print("Warning: Model not found. Using cl100k_base encoding.")
+        return tiktoken.get_encoding("cl100k_base")
+
 def estimate_token_count(text: str, model: str = DEFAULT_MODEL) -> int:
     """
     Estimates the number of tokens a string will occupy for a given model.
@@ -26,69 +40,113 @@ def estimate_token_count(text: str, model: str = DEFAULT_MODEL) -> int:
     Returns:
         int: The estimated number of tokens.
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: Model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    
-    return len(encoding.encode(text))
+    # Transcripts never contain special tokens, so the plain encoder is enough
+    return len(_get_encoding(model).encode_ordinary(text))
+
+def estimate_token_counts(texts: List[str], model: str = DEFAULT_MODEL) -> List[int]:
+    """
+    Estimates the token count of many strings at once.
+
+    The batch encoder runs in tiktoken's native threads, which is much faster
+    than calling `estimate_token_count` in a Python loop.
+
+    Args:
+        texts (List[str]): The input texts.
+        model (str): The model name to estimate tokens for.
+
+    Returns:
+        List[int]: The estimated number of tokens for each text, in order.
+    """
+    encoded = _get_encoding(model).encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+    return [len(tokens) for tokens in encoded]
+
+def _build_chunk(parts: List[str], start_time: float, end_time: float) -> Dict[str, Any]:
+    """
+    Joins buffered segment texts into a chunk dictionary. The display timestamp
+    is formatted once here and reused by the prompt and the rendered notes.
+    """
+    return {
+        "text": " ".join(parts).strip(),
+        "start_time": start_time,
+        "end_time": end_time,
+        "timestamp_str": f"{format_timestamp(start_time)} - {format_timestamp(end_time)}"
+    }
 
 def chunk_transcript_segments(
     segments: List[Dict[str, Any]], 
-    max_tokens_per_chunk: int = 4000
+    max_tokens_per_chunk: int = 4000,
+    min_tokens_per_chunk: int = 1500
 ) -> Generator[Dict[str, Any], None, None]:
     """
     Chunks transcript segments into manageable sizes based on a token limit.
     This is crucial for processing long lectures without exceeding API context windows.
 
+    Chunks are filled greedily up to `max_tokens_per_chunk`. A final tail shorter
+    than `min_tokens_per_chunk` is merged into the previous chunk instead of being
+    sent on its own, so that chunk may exceed the maximum by up to
+    `min_tokens_per_chunk` tokens. Fewer, longer requests are cheaper and faster
+    overall than many short ones, because every request pays a fixed overhead.
+
     Args:
         segments (List[Dict[str, Any]]): A list of whisper transcript segments.
         max_tokens_per_chunk (int): The maximum number of tokens allowed per chunk.
+        min_tokens_per_chunk (int): Final chunks smaller than this are merged into
+            the previous chunk. Use 0 to disable merging.
 
     Yields:
         Generator[Dict[str, Any], None, None]: A generator of chunks, each containing
-        'text', 'start_time', and 'end_time'.
+        'text', 'start_time', 'end_time', and 'timestamp_str'.
     """
-    current_chunk_text = ""
-    current_chunk_start_time = 0
-    chunk_segments = []
-
     if not segments:
         return
 
+    # Segment texts are buffered in a list and joined once per chunk, rather
+    # than concatenated on every segment. Only the chunk's time span is tracked.
+    chunk_parts: List[str] = []
+    current_tokens = 0
     current_chunk_start_time = segments[0]['start']
+    current_chunk_end_time = segments[0]['end']
+
+    # The last full chunk is held back by one step, so a short final tail can
+    # still be merged into it.
+    previous_chunk = None
 
-    for segment in segments:
+    # Tokenize every segment up front in one batch, then keep a running total
+    # instead of re-encoding the whole growing chunk.
+    token_counts = estimate_token_counts([segment['text'] for segment in segments])
+
+    for segment, segment_tokens in zip(segments, token_counts):
         segment_text = segment['text']
         
-        # Estimate tokens for the current chunk if this new segment is added
-        potential_chunk_text = current_chunk_text + " " + segment_text
-        if estimate_token_count(potential_chunk_text) > max_tokens_per_chunk:
-            # Yield the current chunk if it's not empty
-            if current_chunk_text:
-                yield {
-                    "text": current_chunk_text.strip(),
-                    "start_time": current_chunk_start_time,
-                    "end_time": chunk_segments[-1]['end']
-                }
+        # Joining with a space costs ~1 token
+        separator_tokens = 1 if chunk_parts else 0
+
+        if chunk_parts and current_tokens + separator_tokens + segment_tokens > max_tokens_per_chunk:
+            if previous_chunk is not None:
+                yield _build_chunk(*previous_chunk)
+            previous_chunk = (chunk_parts, current_chunk_start_time, current_chunk_end_time)
             
             # Start a new chunk with the current segment
-            current_chunk_text = segment_text
-            chunk_segments = [segment]
+            chunk_parts = [segment_text]
+            current_tokens = segment_tokens
             current_chunk_start_time = segment['start']
         else:
             # Add the segment to the current chunk
-            current_chunk_text = potential_chunk_text
-            chunk_segments.append(segment)
+            chunk_parts.append(segment_text)
+            current_tokens += separator_tokens + segment_tokens
+
+        current_chunk_end_time = segment['end']
+
+    if previous_chunk is not None:
+        if current_tokens < min_tokens_per_chunk:
+            # Merge the short tail into the previous chunk
+            chunk_parts = previous_chunk[0] + chunk_parts
+            current_chunk_start_time = previous_chunk[1]
+        else:
+            yield _build_chunk(*previous_chunk)
 
     # Yield the last remaining chunk
-    if current_chunk_text:
-        yield {
-            "text": current_chunk_text.strip(),
-            "start_time": current_chunk_start_time,
-            "end_time": chunk_segments[-1]['end']
-        }
+    yield _build_chunk(chunk_parts, current_chunk_start_time, current_chunk_end_time)
 
 def format_timestamp(seconds: float) -> str:
     """